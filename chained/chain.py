@@ -3,46 +3,197 @@ Chain core classes - allows cascading selection and editing of
 models linked by foreign keys.
 """
 
-import re
-from django.db.models import Model, ForeignKey
-from django.db.models.query import QuerySet
+import inspect
+import threading
+from itertools import repeat
+from operator import attrgetter
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Model, ForeignKey, Q
+from django.db.models.fields import FieldDoesNotExist
 from django.db.models.fields.related import ManyToManyField
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import (post_save, pre_delete, post_delete,
+        m2m_changed)
+from weakref import ref
+
+# the same model names come up in every chain that uses them
+_underscore_names = {}
 
 def _capwords_to_underscore(name):
-    return re.sub(r'(?<=[a-z])[A-Z]', r"_\g<0>", name).lower()
+    # CapWords to underscore_separated - an underscore goes before any
+    # capital that follows a lower case letter
+    try:
+        return _underscore_names[name]
+    except KeyError:
+        pass
 
-def _get_related_fields(model, target_model):
-    # Return all fields related to the provided model
+    result = []
+    follows_lower = False
+    for char in name:
+        if follows_lower and char.isupper():
+            result.append('_')
+        result.append(char.lower())
+        follows_lower = char.islower()
+
+    result = _underscore_names[name] = ''.join(result)
+    return result
+
+def _first(qs):
+    # Returns the first object of a queryset, or None if it's empty
+    for obj in qs[:1]:
+        return obj
+    return None
+
+# model metadata doesn't change at runtime, so related field lookups
+# are cached per (model, target_model) pair
+_related_field_cache = {}
+
+def _first_related_field(model, target_model):
+    # Return the first field on model that relates it to target_model,
+    # or None if there isn't one
+    key = (model, target_model)
+    try:
+        return _related_field_cache[key]
+    except KeyError:
+        pass
 
-    # get all fields on this link's
-    # model
+    # search the fields on this link's model, stopping at the
+    # first one with a relation to the target
     fields = model._meta.local_fields + \
              model._meta.local_many_to_many
-    
-    # filter those for ones with a relation
-    relation_fields = [field for field in fields if hasattr(field, "related") and field.related != None and field.related.parent_model == target_model]
-
-    return relation_fields
-
-class ChainLinkInstanceAccessDescriptor(object):
-    """
-    Exposes a property of the owner ChainLink's related instance
-    """    
-    def __init__(self, member):
-        """
-        Builds the property - member is a string naming the
-        property to be accessed.
-        """
-        self.member = member
-
-    def __get__(self, instance, type=None):
-        assert instance.instance != None
-        return getattr(instance.instance, self.member)
-    
-    def __set__(self, instance, value):
-        assert instance.instance != None
-        setattr(instance.instance, self.member, value)       
+    field = next((field for field in fields 
+            if getattr(getattr(field, "related", None), "parent_model", 
+                    None) == target_model), None)
+
+    _related_field_cache[key] = field
+    return field
+
+def _resolve_relation(parent_model, child_model, field=None):
+    # Returns a (child_relation, parent_relation, parent_relation_is_m2m,
+    # parent_attname) tuple describing how to walk between a parent and
+    # child model - parent_attname is the child's foreign key column
+    # when there is one. A specific field can be specified to link on
+    # in the case that there are multiple fields connecting the two
+
+    if not field:
+        # if no field was passed, find the first field
+        # that relates the parent model to the child model
+        field = (_first_related_field(parent_model, child_model) or 
+                _first_related_field(child_model, parent_model))
+        if field is None:
+            message = "No relation exists between a %s and a %s."
+            raise AttributeError(message % (parent_model, child_model))
+
+    # figure out which direction we're coming from -
+    # many-to-many relations can exist on either model
+    is_m2m = isinstance(field, ManyToManyField)
+    parent_attname = None
+    if field.related.parent_model == parent_model:
+        child_relation = field.related.get_accessor_name()
+        parent_relation = field.name
+        if not is_m2m:
+            parent_attname = field.attname
+    elif field.related.model == parent_model:
+        child_relation = field.name
+        parent_relation = field.related.get_accessor_name()
+    else:
+        message  = "The provided field %s does not"
+        message += " specifiy a relation between a"
+        message += " %s and a %s."
+        message = message % (field, parent_model, child_model)
+        raise AttributeError(message)
+
+    return child_relation, parent_relation, is_m2m, parent_attname
+
+def _link_classes(links):
+    # Stores the relations between each adjacent pair of link classes
+    # on the classes themselves, so that chain instances only need to
+    # connect the links up
+    for (parent_key, parent), (child_key, child) in zip(links, links[1:]):
+        relation = _resolve_relation(parent._meta.model, child._meta.model)
+        parent._child_relation = relation[0]
+        child._parent_relation = relation[1]
+        child._parent_relation_is_m2m = relation[2]
+        child._parent_attname = relation[3]
+
+# save and delete signals are handed only to the links which have the
+# instance selected - weak references to links are filed here by id
+# under the (model, pk) of their selection, with unsaved selections
+# under a pk of None
+_selected_links = {}
+
+# the registry is shared by every thread that uses chains
+_registry_lock = threading.Lock()
+
+# keys which lost a link to garbage collection - the weakref callbacks
+# only queue the key, and it's pruned on the next registry update
+_dead_selections = []
+
+def _selection_died(key):
+    # Builds the weakref callback for a link filed under key
+    return lambda link_ref: _dead_selections.append(key)
+
+def _prune_dead_selections():
+    # Drops the references to garbage collected links, and the keys
+    # left without any links - the registry lock must be held
+    while _dead_selections:
+        key = _dead_selections.pop()
+        refs = _selected_links.get(key)
+        if refs is None:
+            continue
+        for link_id, link_ref in refs.items():
+            if link_ref() is None:
+                del refs[link_id]
+        if not refs:
+            _selected_links.pop(key, None)
+
+# bumped whenever an instance of a model is saved or deleted, or its
+# many-to-many relations change, so links can tell when the sibling
+# pks they've cached may be stale
+_model_versions = {}
+
+def _links_selecting(sender, instance, created=False):
+    # Returns the links that have the given instance selected
+    with _registry_lock:
+        _prune_dead_selections()
+        refs = _selected_links.get((sender, instance.pk))
+        result = [link_ref() for link_ref in refs.values()] if refs else []
+
+        if created:
+            # a newly saved instance was filed under a pk of None, and
+            # only the links holding that very object are told about it
+            # - another object under the same pk is a stale selection
+            # of a row that was deleted and created again
+            refs = _selected_links.get((sender, None))
+            if refs:
+                result.extend(link_ref() for link_ref in refs.values())
+            result = [link for link in result 
+                    if link is not None and link.instance is instance]
+    return [link for link in result if link is not None]
+
+def _post_save_dispatch(sender, instance, created, **kwargs):
+    _model_versions[sender] = _model_versions.get(sender, 0) + 1
+    for link in _links_selecting(sender, instance, created):
+        # a created instance has a new pk to be filed under
+        link._register()
+        link._post_save_received(sender, instance=instance, 
+                created=created, **kwargs)
+
+def _pre_delete_dispatch(sender, instance, **kwargs):
+    _model_versions[sender] = _model_versions.get(sender, 0) + 1
+    for link in _links_selecting(sender, instance):
+        link._pre_delete_received(sender, instance=instance, **kwargs)
+
+def _post_delete_dispatch(sender, instance, **kwargs):
+    # links may have refetched sibling pks while the row still existed
+    # (moving off it in pre_delete), so those are made stale again
+    _model_versions[sender] = _model_versions.get(sender, 0) + 1
+
+def _m2m_changed_dispatch(sender, instance, action, model, **kwargs):
+    # many-to-many link sets change without either side being saved,
+    # so both models' sibling pks are made stale
+    if action.startswith('post_'):
+        for changed in (instance.__class__, model):
+            _model_versions[changed] = _model_versions.get(changed, 0) + 1
 
 class BaseChainLink(object):
     """
@@ -52,67 +203,74 @@ class BaseChainLink(object):
     save, create, delete, and select objects which exist on the tied 
     model.
     """
+    # relation accessor names - these are resolved once per link class
+    # by the chain metaclasses (see _link_classes)
+    _parent_relation = None
+    _parent_relation_is_m2m = False
+    _parent_attname = None
+    _child_relation = None
+
+    # model constants - these are cached on each link class by
+    # ChainLinkMetaclass
+    _manager = None
+    _sibling_order = ('pk',)
+    _reverse_sibling_order = ('-pk',)
+    _filterable_order = True
+
+    # links are created for every chain instance, so they keep their
+    # state in slots - __weakref__ is needed for signal receivers
+    __slots__ = ('_chain', 'instance', '_selected_key', '_parent_link', 
+            '_child_link', '_children_cache', '_link_set_cache', 
+            '_sibling_pks', '_in_save', '__weakref__')
+
+    # names of the link's own members - set up by ChainLinkMetaclass
+    _reserved_names = frozenset()
+
     def __init__(self, chain=None):
         """
         Create a ChainLink for the specified chain.
         """
         self._chain = chain
+        self._selected_key = None
         self.instance = None
 
         self._parent_link = None
-        self._parent_relation = None
-        self._parent_relation_is_m2m = False
-
         self._child_link = None
-        self._child_relation = None
-
-        post_save.connect(self._post_save_received, sender=self._meta.model)
-        pre_delete.connect(self._pre_delete_received, 
-                sender=self._meta.model)
-
-    def _link_child(self, child_link, field=None):
-        # links a child to this ChainLink - a specific
-        # field can be specified to link on in the case
-        # that there are multiple fields connecting the
-        # two
-
-        if not field:
-            # if no field was passed, find the first field
-            # that relates this link's model to the 
-            # child link's model
-
-            # these aspects should probably be refactored out
-            # such that fields are determined at initialization
-            # time rather than as a link is being made
-            fields = _get_related_fields(self._meta.model, 
-                    child_link._meta.model) + \
-                    _get_related_fields(child_link._meta.model, 
-                            self._meta.model)
-
-            field = fields[0]
-        
-        # figure out which direction we're coming from -
-        # many-to-many relations can exist on either model
-        if field.related.parent_model == self._meta.model:
-            self._child_relation = field.related.get_accessor_name()
-            child_link._parent_relation = field.name
-        elif field.related.model == self._meta.model:
-            self._child_relation = field.name
-            child_link._parent_relation = \
-                    field.related.get_accessor_name()
+
+        # (instance, pk, queryset) cached by children() and link_set(),
+        # and the (model version, ordered pks) of the link set used by
+        # index()
+        self._children_cache = None
+        self._link_set_cache = None
+        self._sibling_pks = None
+
+        # set while the link saves its own instance
+        self._in_save = False
+
+    def _register(self):
+        # Files this link in the signal registry under its current
+        # selection
+        old_key = self._selected_key
+        instance = self.instance
+        if instance is None:
+            key = None
         else:
-            message  = "The provided field %s does not"
-            message += " specifiy a relation between a"
-            message += " %s and a %s."
-            message = message % (field, self._meta.model, 
-                    child_link._meta.model)
-            raise AttributeError(message)
-        
-        child_link._parent_relation_is_m2m = isinstance(field,
-                ManyToManyField)
+            key = (self._meta.model, instance.pk)
+        if key == old_key:
+            return
 
-        self._child_link = child_link
-        child_link._parent_link = self
+        with _registry_lock:
+            _prune_dead_selections()
+            if old_key is not None:
+                refs = _selected_links.get(old_key)
+                if refs is not None:
+                    refs.pop(id(self), None)
+                    if not refs:
+                        _selected_links.pop(old_key, None)
+            if key is not None:
+                refs = _selected_links.setdefault(key, {})
+                refs[id(self)] = ref(self, _selection_died(key))
+            self._selected_key = key
 
     def _did_select(self):
         # a method for adding special processing to ChainLinks
@@ -123,7 +281,7 @@ class BaseChainLink(object):
         """
         Performs a 'get' to select this link's instance.
         """
-        self.select(self._meta.model.objects.get(**kwargs))
+        self.select(self._manager.get(**kwargs))
 
     def select_first(self):
         """
@@ -159,6 +317,10 @@ class BaseChainLink(object):
         If this is a new object, set it's parent field appropriately.
         """
 
+        # reselecting the current instance leaves the chain as it is
+        if model_instance is self.instance:
+            return
+
         # ensure that if we're setting the instance
         # to a new object, that there is an object selected
         # on the chainlink above
@@ -182,21 +344,48 @@ class BaseChainLink(object):
         """
         Returns true if this object has an instance set.
         """
-        return self.instance != None
+        return self.instance is not None
 
     def link_set(self):
         """
         Gets a queryset containing all the currently selected parents
-        children or all top level objects, ordered by default ordering,
-        or the public key if none is specified
+        children or all top level objects, ordered by default ordering
+        and then by the primary key
         """
-        if self._parent_link:
-            qs = self._parent_link.children()
-        else:
-            qs = self._meta.model.objects.all()
-        if not self._meta.model._meta.ordering:
-            qs.order_by("pk")
-        return qs
+        parent = self._parent_link and self._parent_link.instance
+        parent_pk = getattr(parent, 'pk', None)
+
+        # the queryset only depends on the parent's selection, so it's
+        # rebuilt when that changes - callers get a clone
+        cached = self._link_set_cache
+        if (cached is None or cached[0] is not parent or 
+                cached[1] != parent_pk):
+            if self._parent_link:
+                qs = self._parent_link.children()
+            else:
+                qs = self._manager.all()
+            qs = qs.order_by(*self._sibling_order)
+            cached = self._link_set_cache = (parent, parent_pk, qs)
+            self._sibling_pks = None
+        return cached[2].all()
+
+    def _get_sibling_pks(self, refresh=False):
+        # The pks of the link set in order - fetched once per parent
+        # selection, so positions can be found without further queries,
+        # and refetched after any instance of the model is saved or
+        # deleted, or when refresh is set
+        qs = self.link_set()
+        version = _model_versions.get(self._meta.model, 0)
+        cached = self._sibling_pks
+        if refresh or cached is None or cached[0] != version:
+            pks = list(qs.values_list('pk', flat=True))
+            cached = self._sibling_pks = (version, pks)
+        return cached[1]
+
+    def _clear_link_set(self):
+        # Drops the cached link set, for when its rows may have changed
+        self._link_set_cache = None
+        self._sibling_pks = None
         
     def index(self):
         """
@@ -204,12 +393,15 @@ class BaseChainLink(object):
         its parent - or if it has no parent, in relation to all
         objects of this ChainLink's model
         """
-        qs = self.link_set()
+        for refresh in (False, True):
+            try:
+                return self._get_sibling_pks(refresh).index(self.instance.pk)
+            except ValueError:
+                # rows can change without sending signals - through
+                # update(), raw SQL or another process - so the pks are
+                # refetched once before giving up
+                pass
 
-        for i, obj in enumerate(qs):
-            if obj == self.instance:
-                return i
-        
         if self._parent_link:
             message = "%s instance %s not found in chained children of %s"
             message = message % (self._meta.model, self.instance, 
@@ -219,72 +411,108 @@ class BaseChainLink(object):
             message = message % (self._meta.model, self.instance)
         raise KeyError(message)
 
+    def _sibling_filter(self, after):
+        # Builds a Q object matching the siblings ordered after (or
+        # before) the current instance, so that the nearest one can be
+        # fetched with a single query. Returns None if the ordering
+        # can't be expressed as a filter.
+        if not self._filterable_order:
+            return None
+        result = None
+        preceding = Q()
+        for field in self._sibling_order:
+            name = field.lstrip('-')
+            value = getattr(self.instance, name)
+
+            # descending fields flip the comparison
+            if after != field.startswith('-'):
+                lookup = '%s__gt' % name
+            else:
+                lookup = '%s__lt' % name
+            term = preceding & Q(**{lookup: value})
+            result = term if result is None else result | term
+            preceding &= Q(**{name: value})
+        return result
+
     def next_sibling(self, **kwargs):
         """
         Finds the next sibling of the currently selected instance.
         """
 
-        assert self.selected()
-
-        qs = self.link_set()
-        count = qs.count()
-        if not count:
-            return None
-
-        index = self.index()
-        if index + 1 >= count:
-            return None
-        else:
-            return qs[index+1]
+        assert self.instance is not None, 'No instance selected'
+        return self._get_sibling(after=True)
 
     def previous_sibling(self, **kwargs):
         """
         Finds the next sibling of the currently selected instance.
         """
-        assert self.selected()
+        assert self.instance is not None, 'No instance selected'
+        return self._get_sibling(after=False)
 
+    def _get_sibling(self, after):
+        # fetch the adjacent sibling with one ordered LIMIT 1 query
         qs = self.link_set()
-        count = qs.count()
-        if not count:
-            return None
-
-        index = self.index()
-        if index - 1 < 0:
-            return None
-        else:
-            return qs[index-1]
+        sibling_filter = self._sibling_filter(after)
+        if sibling_filter is not None:
+            if after:
+                qs = qs.filter(sibling_filter).order_by(*self._sibling_order)
+            else:
+                qs = qs.filter(sibling_filter).order_by(
+                        *self._reverse_sibling_order)
+            return _first(qs)
+
+        # fall back to the position of the current instance - if the
+        # cached pks name a row that's no longer a sibling, they're
+        # refetched once
+        for refresh in (False, True):
+            if refresh:
+                self._sibling_pks = None
+            index = self.index() + (1 if after else -1)
+            pks = self._get_sibling_pks()
+            if index < 0 or index >= len(pks):
+                return None
+            sibling = _first(self.link_set().filter(pk=pks[index]))
+            if sibling is not None:
+                return sibling
+        return None
     
     def first(self, **kwargs):
         """
         Finds the first sibling of the currently selected instance.
         """
-        qs = self.link_set()
-        count = qs.count()
-        if not count:
-            return None
-        
-        return qs[0]
+        return _first(self.link_set())
 
     def last(self, **kwargs):
         """
         Finds the last sibling of the currently selected instance.
         """
-        qs = self.link_set()
-        count = qs.count()
-        if not count:
-            return None
-        
-        return qs[qs.count()-1]
+        # link_set is always ordered, so it can be reversed
+        return _first(self.link_set().reverse())
 
     def children(self):
         """
         Returns all children of this ChainLink's instance as a QuerySet
         """
-        assert self.selected()
+        assert self.instance is not None, 'No instance selected'
         if not self._child_link:
-            return self._meta.model.objects.none()
-        
-        return getattr(self.instance, self._child_relation).all()
+            return self._manager.none()
+
+        # building the related manager's queryset is relatively costly,
+        # so it's kept until a different instance is selected - callers
+        # get a clone so the cached queryset is never evaluated
+        instance = self.instance
+        cached = self._children_cache
+        if (cached is None or cached[0] is not instance or 
+                cached[1] != instance.pk):
+            qs = getattr(instance, self._child_relation).all()
+            child_link = self._child_link
+            if child_link._parent_attname:
+                # children reached through a foreign key come with it
+                # joined, so reading their parent doesn't cost a query
+                # per child
+                qs = qs.select_related(child_link._parent_relation)
+            cached = self._children_cache = (instance, instance.pk, qs)
+        return cached[2].all()
 
     def _get_first_parent(self):
         # If an instance is selected on this link, return the first
@@ -292,14 +520,18 @@ class BaseChainLink(object):
         if not self.instance:
             return None
         
+        if self._parent_attname:
+            # the related object may be cached from before the foreign
+            # key was changed, so the parent is fetched by the key
+            parent_pk = getattr(self.instance, self._parent_attname)
+            return _first(self._parent_link._manager.filter(pk=parent_pk))
+
         result = getattr(self.instance, self._parent_relation)
 
-        if isinstance(result, QuerySet):
-            # if this is a queryset, return the first object
-            if len(result) > 0:
-                return result[0]
-            else:
-                return None
+        if self._parent_relation_is_m2m:
+            # many-to-many relations give a manager - fetch just the
+            # first object from it
+            return _first(result.all())
         else:
             # otherwise it should be an object
             return result
@@ -315,10 +547,14 @@ class BaseChainLink(object):
             return
 
         # if the child instance is already child of this link's parent
-        # instance, we don't cascade up the chain.
-        children = self.children()
-        if (children and 
-                children.filter(pk=self._child_link.instance.pk).exists()):
+        # instance, we don't cascade up the chain. A foreign key on the
+        # child can be checked without a query.
+        child = self._child_link
+        if child._parent_attname is not None:
+            parent_pk = getattr(child.instance, child._parent_attname)
+            if self.instance is not None and parent_pk == self.instance.pk:
+                return
+        elif self.children().filter(pk=child.instance.pk).exists():
             return
         
         # otherwise, select the first parent of the child link's instance
@@ -335,16 +571,18 @@ class BaseChainLink(object):
                 self._parent_link.instance.pk == None):
             self.instance = None
         else:
-            children = self._parent_link.children()
-            if children.count() > 0:
+            # the link set is this link's share of the parent's
+            # children, and stays cached for sibling navigation
+            first = _first(self.link_set())
+            if first is not None:
                 # if children exist on the parent, select the first
-                self.instance = children[0]
+                self.instance = first
             else:
                 # automatically create and select (but don't save)
                 # a new instance of this link's model if
                 # auto_create_defaults is set
                 if self._chain.auto_create_defaults:
-                    self.instance = model()
+                    self.instance = self._new_default()
                 else:
                     self.instance = None
         
@@ -352,19 +590,32 @@ class BaseChainLink(object):
         if self._child_link:
             self._child_link._cascade_from_parent()
     
+    def _new_default(self):
+        # a new instance for auto_create_defaults - a foreign key to the
+        # parent is filled in now so the instance can be saved as is
+        instance = self._meta.model()
+        if self._parent_attname:
+            setattr(instance, self._parent_attname, 
+                    self._parent_link.instance.pk)
+        return instance
+
     def _post_save_received(self, sender, instance, created, **kwargs):
-        # when an object in this chain gets saved, make sure
+        # when the object selected on this link gets saved, make sure
         # its parent is set if it was just created, or
         # cascade from this object to select correct objects
         # in the case of a move
-        if not instance == self.instance:
+
+        # make sure we don't get stuck in a signal loop
+        if self._in_save:
             return
 
+        # children of the saved instance may have been changed along
+        # with it, eg. through a many-to-many manager
+        if self._child_link:
+            self._child_link._clear_link_set()
+
         # set parents on newly saved instances
         if created and self._parent_link:
-            # make sure we don't get stuck in a signal loop
-            post_save.disconnect(self._post_save_received, self._meta.model)
-
             # on m2m relations we need to add parents, not set them
             if self._parent_relation_is_m2m:
                 related_set = getattr(self.instance, self._parent_relation)
@@ -373,10 +624,12 @@ class BaseChainLink(object):
                 setattr(self.instance, self._parent_relation, 
                     self._parent_link.instance)
 
-            # save changes and reset the signal listener
-            self.instance.save()
-            post_save.connect(self._post_save_received, 
-                    sender=self._meta.model)
+            # save changes without handling our own signal
+            self._in_save = True
+            try:
+                self.instance.save()
+            finally:
+                self._in_save = False
         
         # allow moving by updating the chain after a save - we only
         # do this when an object wasn't created to allow a person
@@ -388,10 +641,8 @@ class BaseChainLink(object):
                 self._child_link._cascade_from_parent()
 
     def _pre_delete_received(self, sender, instance, **kwargs):
-        # when an object is deleted, we want to make sure
+        # when the selected object is deleted, we want to make sure
         # we shift selection to a different object
-        if not instance == self.instance:
-            return
 
         select = self.previous_sibling()
         if not select:
@@ -399,35 +650,63 @@ class BaseChainLink(object):
         
         self.select(select)
 
-    # implement the descriptor protocol to allow for
-    # funky nice setting of links
-    def __get__(self, instance, owner):
-        return self
-    
-    def __set__(self, instance, value):
-        # Sets a chain link to point to the provided
-        # model instance.
-        if issubclass(value.__class__, Model):
-            self.select(value)
-        elif issubclass(value.__class__, ChainLink):
-            message = 'Cannot replace chain links'
-            raise ValueError(message)
-        else:
-            message = 'Cannot set link to %s instance' % \
-                      (value.__class__.__name__)
-            raise ValueError(message)
-    
-    def __delete__(self, instance):
-        raise AttributeError('Cannot delete a ChainLink')
+    def __getattr__(self, name):
+        # Exposes the members of the selected instance - this is only
+        # called for names that aren't found on the link itself
+        if name.startswith('__') or name == 'instance':
+            raise AttributeError(name)
+        instance = self.instance
+        if instance is None:
+            message = "'%s' has no attribute '%s' and no instance selected"
+            raise AttributeError(message % (self.__class__.__name__, name))
+
+        # members hidden by the link's own attributes are available
+        # with an 'instance_' prefix
+        if (name.startswith('instance_') and 
+                name[len('instance_'):] in self._reserved_names):
+            name = name[len('instance_'):]
+        return getattr(instance, name)
+
+    def __setattr__(self, name, value):
+        # The link's own members are set on the link - everything else
+        # (fields, related managers, properties) is written through to
+        # the selected instance
+        if name in self._reserved_names:
+            super(BaseChainLink, self).__setattr__(name, value)
+            if name == 'instance':
+                self._register()
+            return
+
+        assert self.instance is not None, 'No instance selected'
+        if (name.startswith('instance_') and 
+                name[len('instance_'):] in self._reserved_names):
+            name = name[len('instance_'):]
+        setattr(self.instance, name, value)
+
+def _meta_attrs(options):
+    # Collects the attributes of a Meta class, including inherited ones,
+    # into one dict so options can be read without repeated getattr calls
+    attrs = {}
+    if options is not None:
+        for base in reversed(inspect.getmro(options)):
+            attrs.update(vars(base))
+    return attrs
 
 class ChainLinkOptions(object):
+    __slots__ = ('model',)
+
     def __init__(self, options=None):
-        self.model = getattr(options, 'model', None)
+        self._load(_meta_attrs(options))
+
+    def _load(self, attrs):
+        self.model = attrs.get('model')
 
 class ChainLinkMetaclass(type):
     """
     Allows a chain link to reflect the selected model instance.
     """
+    options_class = ChainLinkOptions
+
     def __new__(cls, name, bases, attrs):
         new_class = super(ChainLinkMetaclass, cls).__new__(cls, name, bases, 
                 attrs)
@@ -436,43 +715,103 @@ class ChainLinkMetaclass(type):
             parents = [b for b in bases if issubclass(b, ChainLink)]
         except NameError:
             return new_class
-        options = new_class._meta = ChainLinkOptions(getattr(new_class, 
+        options = new_class._meta = cls.options_class(getattr(new_class, 
                 'Meta', None))
         if options.model:
             ChainLinkMetaclass.make_attributes(new_class)
+            ChainLinkMetaclass.make_ordering(new_class)
+            ChainLinkMetaclass.make_signals(new_class)
         return new_class
-    
+
     def make_attributes(new_class):
-        for member in dir(new_class._meta.model()):
-            attr_name = name = member
-            while hasattr(new_class, attr_name):
-                attr_name = "instance_%s" % name
-            setattr(new_class, attr_name, 
-                    ChainLinkInstanceAccessDescriptor(name))
+        # model fields are read from the selected instance through
+        # properties - everything else is read through
+        # BaseChainLink.__getattr__, and writes to anything but the
+        # link's own members go through BaseChainLink.__setattr__
+        model_meta = new_class._meta.model._meta
+        names = set(['pk'])
+        for field in model_meta.fields + model_meta.many_to_many:
+            names.add(field.name)
+            names.add(field.attname)
+
+        # dir() includes the slots, so the link's own state is reserved
+        reserved = new_class._reserved_names = frozenset(dir(new_class))
+
+        # the getter raises AttributeError while nothing is selected,
+        # which falls back to __getattr__ for the error message
+        for name in names - reserved:
+            setattr(new_class, name, property(
+                    attrgetter('instance.' + name)))
+
+    def make_ordering(new_class):
+        # cache the manager and ordering used to build link sets - pk
+        # is added to the model's ordering as a tie-breaker, so link
+        # sets and sibling lookups agree on rows with equal values
+        model = new_class._meta.model
+        new_class._manager = model._default_manager
+
+        sibling_order = tuple(model._meta.ordering)
+        if 'pk' not in sibling_order and '-pk' not in sibling_order:
+            sibling_order += ('pk',)
+        new_class._sibling_order = sibling_order
+        new_class._reverse_sibling_order = tuple(
+                field[1:] if field.startswith('-') else '-' + field
+                for field in sibling_order)
+
+        # only plain, non-null fields compare in SQL the way they sort -
+        # NULLs never match a comparison and relations sort by the
+        # related model's ordering - so anything else falls back to the
+        # cached sibling pks
+        filterable = True
+        for field in sibling_order:
+            name = field.lstrip('-')
+            if name == 'pk':
+                continue
+            try:
+                model_field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                filterable = False
+                break
+            if model_field.rel is not None or model_field.null:
+                filterable = False
+                break
+        new_class._filterable_order = filterable
+
+    def make_signals(new_class):
+        # signals are received once per model, however many link
+        # classes and chains use it, and dispatched from there
+        model = new_class._meta.model
+        post_save.connect(_post_save_dispatch, sender=model, weak=False,
+                dispatch_uid='chained_post_save')
+        pre_delete.connect(_pre_delete_dispatch, sender=model, weak=False,
+                dispatch_uid='chained_pre_delete')
+        post_delete.connect(_post_delete_dispatch, sender=model, 
+                weak=False, dispatch_uid='chained_post_delete')
+
+        # many-to-many changes are sent by the intermediary models,
+        # which may belong to apps that aren't loaded yet - one receiver
+        # takes them all and reads the models from the signal
+        m2m_changed.connect(_m2m_changed_dispatch, weak=False,
+                dispatch_uid='chained_m2m_changed')
 
 class FormChainLinkOptions(ChainLinkOptions):
-    def __init__(self, options=None):
-        self.form_class = getattr(options, 'form_class', None)
-        super(FormChainLinkOptions, self).__init__(options)
+    __slots__ = ('form_class',)
+
+    def _load(self, attrs):
+        super(FormChainLinkOptions, self)._load(attrs)
+        self.form_class = attrs.get('form_class')
     
 class FormChainLinkMetaclass(ChainLinkMetaclass):
-    def __new__(cls, name, bases, attrs):
-        new_class = super(FormChainLinkMetaclass, cls).__new__(cls, 
-                name, bases, attrs)
-        # make sure we aren't defining FormChainLink itself
-        try:
-            parents = [b for b in bases if issubclass(b, FormChainLink)]
-        except NameError:
-            return new_class
-        options = new_class._meta = FormChainLinkOptions(
-                getattr(new_class,'Meta', None))
-        return new_class
+    # ChainLinkMetaclass builds the options, including the form class
+    options_class = FormChainLinkOptions
 
 class ChainLink(BaseChainLink):
     __metaclass__ = ChainLinkMetaclass
+    __slots__ = ()
 
 class FormChainLink(BaseChainLink):
     __metaclass__ = FormChainLinkMetaclass
+    __slots__ = ('_form',)
 
     def __init__(self, chain):
         """
@@ -482,12 +821,6 @@ class FormChainLink(BaseChainLink):
         super(FormChainLink, self).__init__(chain)
         self._form = None
     
-    def _did_select(self):
-        if not self.instance:
-            self._form = None
-        else:
-            self._form = self._meta.form_class(instance=self.instance)
-
     def save_form_data(self, data=None, files=None, commit=True):
         """
         Saves form data.
@@ -495,13 +828,59 @@ class FormChainLink(BaseChainLink):
         form = self._meta.form_class(data=data, files=files, 
                 instance=self.instance)
         self.instance = form.save(commit=commit)
+        self._form = None
 
         # save this instance to make sure we hook up to a parent.
         self.instance.save()
+
+    def _post_save_received(self, sender, instance, created, **kwargs):
+        # a form holds the values its instance had when it was built,
+        # so it's rebuilt once the instance has been saved
+        self._form = None
+        super(FormChainLink, self)._post_save_received(sender, instance,
+                created, **kwargs)
     
     @property
     def form(self):
-        return self._form
+        # the form is built when it's first asked for, so selections
+        # that never show it don't pay for it - cascades change the
+        # instance without going through select(), so the form is
+        # checked against the instance rather than reset on selection
+        instance = self.instance
+        if instance is None:
+            return None
+        form = self._form
+        if form is None or form.instance is not instance:
+            form = self._form = self._meta.form_class(instance=instance)
+        return form
+
+class ChainLinkDescriptor(object):
+    """
+    Allows for funky nice setting of a chain's links to model instances.
+
+    Only setting and deleting are handled - links are read straight
+    from the chain instance's __dict__.
+    """
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __set__(self, instance, value):
+        # Sets a chain link to point to the provided
+        # model instance.
+        if issubclass(value.__class__, Model):
+            instance.__dict__[self.key].select(value)
+        elif issubclass(value.__class__, BaseChainLink):
+            message = 'Cannot replace chain links'
+            raise ValueError(message)
+        else:
+            message = 'Cannot set link to %s instance' % \
+                      (value.__class__.__name__)
+            raise ValueError(message)
+
+    def __delete__(self, instance):
+        raise AttributeError('Cannot delete a ChainLink')
 
 class BaseChain(object):
     """
@@ -522,23 +901,23 @@ class BaseChain(object):
         """
         self.auto_create_defaults = auto_create_defaults
 
-        self._links = {}
-        self._links_list = []
+        # links in chain order - they're also reachable by key through
+        # the instance dict, so no separate mapping is kept
+        self._links = []
 
         for key, link_class in self._meta.links:
             new_link = link_class(chain=self)
-            self._links.update({key: new_link})
         
             # link to the last link
-            if len(self._links_list) > 0:
-                last_link = self._links_list[-1]
-                self._connect_links(last_link, new_link)
+            if self._links:
+                self._connect_links(self._links[-1], new_link)
         
             # add the new link to the indexed list
-            self._links_list.append(new_link)
+            self._links.append(new_link)
 
-            # add a property to access this link
-            setattr(self.__class__, key, new_link)
+            # add an attribute to access this link - the chain class
+            # has a ChainLinkDescriptor for the key to handle setting
+            self.__dict__[key] = new_link
         
         self.select_first()
 
@@ -546,111 +925,112 @@ class BaseChain(object):
         """
         Selects the first object available for each link in the chain.
         """
-        if len(self._links_list) > 0:
-            self._links_list[0].select_first()
+        if self._links:
+            self._links[0].select_first()
     
     def _connect_links(self, parent, child):
-        # Connect the parent and child links
-        parent._link_child(child)
+        # Connect the parent and child links - the relations between
+        # them were already resolved when the chain class was built
+        parent._child_link = child
+        child._parent_link = parent
     
     def __iter__(self):
-        for link in self._links_list:
-            yield link
+        return iter(self._links)
+
+
+def _build_link_classes(chain_class, base, models, extra_metas=None):
+    """
+    Creates a link class deriving from base for each model, stores the
+    (key, link class) pairs in chain_class._meta.links and gives the
+    chain class a ChainLinkDescriptor for each key. extra_metas can hold
+    additional Meta attributes for each model's link class.
+    """
+    links = chain_class._meta.links = []
+    if not models:
+        return
+    if extra_metas is None:
+        extra_metas = repeat({})
+
+    for model, extra_meta in zip(models, extra_metas):
+        if isinstance(model, tuple):
+            # a (key, model) pair gives the key for this model
+            key, model = model
+        else:
+            # otherwise generate the key
+            key = _capwords_to_underscore(model.__name__)
+
+        meta_attrs = dict(extra_meta, model=model)
 
+        # create an appropriate link class
+        link_class = type('ChainLink_%s' % key, (base,), 
+                dict(__slots__=(), Meta=type('Meta', (object,), meta_attrs)))
+
+        # add the link to the meta class
+        links.append((key, link_class))
+
+    _link_classes(links)
+    for key, link_class in links:
+        setattr(chain_class, key, ChainLinkDescriptor(key))
 
-# These Chain Metaclasses can probably be refactored to better fit
-# DRY principles.
 class ChainOptions(object):
+    __slots__ = ('models', 'links')
+
     def __init__(self, options=None):
-        self.models = getattr(options, 'models', None)
-        
+        self._load(_meta_attrs(options))
+
+    def _load(self, attrs):
+        self.models = attrs.get('models')
+
+class FormChainOptions(ChainOptions):
+    __slots__ = ('form_classes',)
+
+    def _load(self, attrs):
+        super(FormChainOptions, self)._load(attrs)
+        self.form_classes = attrs.get('form_classes')
+
 class ChainMetaclass(type):
+    """
+    Builds a link class for each of the models a chain lists.
+    """
+    options_class = ChainOptions
+    link_base = ChainLink
+
     def __new__(cls, name, bases, attrs):
         new_class = super(ChainMetaclass, cls).__new__(cls, name, 
                 bases, attrs)
 
-        # check if we're building Chain
-        try:
-            parents = [b for b in bases if issubclass(Chain, b)]
-        except NameError:
+        # make sure we aren't defining Chain or FormChain itself
+        if not [b for b in bases if isinstance(b, ChainMetaclass)]:
             return new_class
 
         # build the class based off options
-        options = new_class._meta = ChainOptions(getattr(new_class, 'Meta', 
-                None))
-        new_class._meta.links = []
-
-        # make accessors for each
-        if options.models:
-            for model in options.models:
-                key = None
-                if isinstance(model, tuple) and len(model) == 2:
-                    # if we're looking at a tuple, split it and  
-                    # take the first entry as the key for this model
-                    key, model = model.split()
-                elif issubclass(model, Model):
-                    # otherwise generate the key
-                    key = _capwords_to_underscore(model.__name__)
-
-                # create an appropriate link class
-                link_class = type('ChainLink_%s' % key, 
-                        (ChainLink,), 
-                        dict(Meta=type('Meta', (object,), 
-                                dict(model=model))))
-
-                # add the link to the meta class
-                new_class._meta.links.append((key, link_class))
+        options = new_class._meta = cls.options_class(getattr(new_class, 
+                'Meta', None))
+        _build_link_classes(new_class, cls.link_base, options.models,
+                cls.link_metas(new_class))
 
         return new_class
 
-class FormChainOptions(ChainOptions):
-    def __init__(self, options=None):
-        self.form_classes = getattr(options, 
-                'form_classes', None)
-        super(FormChainOptions, self).__init__(options)
+    def link_metas(new_class):
+        # extra Meta attributes for each link class - none by default
+        return None
 
-class FormChainMetaclass(type):
-    def __new__(cls, name, bases, attrs):
-        new_class = super(FormChainMetaclass, cls).__new__(cls, name,
-                bases, attrs)
-        
-        # check if we're building FormChain
-        try:
-            parents = [b for b in bases if issubclass(FormChain, b)]
-        except NameError:
-            return new_class
+class FormChainMetaclass(ChainMetaclass):
+    options_class = FormChainOptions
+    link_base = FormChainLink
 
-        # build the class based off options
-        options = new_class._meta = FormChainOptions(getattr(new_class, 
-                'Meta', None))
-        new_class._meta.links = []
-
-        # make accessors for each
-        if options.models:
-            for model, form_class in zip(options.models, 
-                    options.form_classes):
-                key = None
-                if isinstance(model, tuple) and len(model) == 2:
-                    # if we're looking at a tuple, split it and  
-                    # take the first entry as the key for this model
-                    key, model = model.split()
-                elif issubclass(model, Model):
-                    # otherwise generate the key
-                    key = _capwords_to_underscore(model.__name__)
-
-                chain_link_meta = type('Meta', (object,), dict(model=model, 
-                        form_class=form_class))
-
-                chain_link_dict = dict(Meta=chain_link_meta)
-
-                # create an appropriate link class
-                link_class = type('ChainLink_%s' % key, 
-                        (FormChainLink,), 
-                        chain_link_dict)
-
-                # add the link to the meta class
-                new_class._meta.links.append((key, link_class))
-        return new_class
+    def link_metas(new_class):
+        # each link gets the form class listed for its model
+        options = new_class._meta
+        models, form_classes = options.models, options.form_classes
+        if not models:
+            return None
+        if form_classes is None or len(form_classes) != len(models):
+            message = "%s needs a form class in Meta.form_classes for"
+            message += " each of its %d models."
+            raise ImproperlyConfigured(message % (new_class.__name__, 
+                    len(models)))
+        return [dict(form_class=form_class) for form_class in form_classes]
 
 class Chain(BaseChain):
     __metaclass__ = ChainMetaclass
@@ -1,5 +1,6 @@
 from chained import Chain, FormChain
-from chained.tests.server.models import Author, Book, Chapter
+from chained.tests.server.models import (Author, Book, Chapter, Excerpt,
+		Review, Edition)
 from chained.tests.server.forms import AuthorForm, BookForm, ChapterForm
 
 class LibraryChain(Chain):
@@ -9,4 +10,20 @@ class LibraryChain(Chain):
 class LibraryFormChain(FormChain):
 	class Meta:
 		models = [Author, Book, Chapter]
-		form_classes = [AuthorForm, BookForm, ChapterForm]
\ No newline at end of file
+		form_classes = [AuthorForm, BookForm, ChapterForm]
+
+class KeyedLibraryChain(Chain):
+	class Meta:
+		models = [('writer', Author), Book]
+
+class ExcerptChain(Chain):
+	class Meta:
+		models = [Chapter, Excerpt]
+
+class ReviewChain(Chain):
+	class Meta:
+		models = [Book, Review]
+
+class EditionChain(Chain):
+	class Meta:
+		models = [Book, Edition]
@@ -5,11 +5,14 @@ from chained.tests.server.models import Author, Book, Chapter
 class AuthorForm(ModelForm):
 	class Meta:
 		model = Author
+		fields = ['first_name', 'last_name']
 
 class BookForm(ModelForm):
 	class Meta:
 		model = Book
+		fields = ['title', 'authors']
 
 class ChapterForm(ModelForm):
 	class Meta:
-		model = Chapter
\ No newline at end of file
+		model = Chapter
+		fields = ['book', 'number', 'title']
@@ -2,13 +2,13 @@ from django.db import models
 
 class Author(models.Model):
 	first_name = models.CharField(max_length=35)
-	last_name = models.CharField(max_length=35)
+	last_name = models.CharField(max_length=35, db_index=True)
 
 	def __unicode__(self):
 		return "%s %s" % (self.first_name, self.last_name)
 
 class Book(models.Model):
-	title = models.CharField(max_length=100)
+	title = models.CharField(max_length=100, db_index=True)
 	authors = models.ManyToManyField(Author)
 
 	def __unicode__(self):
@@ -22,4 +22,33 @@ class Chapter(models.Model):
 	title = models.CharField(max_length=100)
 
 	def __unicode__(self):
-		return "%d. %s" % (self.number, self.title)
\ No newline at end of file
+		return "%d. %s" % (self.number, self.title)
+
+class Excerpt(models.Model):
+	class Meta:
+		ordering = ['chapter__number', 'page']
+	chapter = models.ForeignKey(Chapter)
+	page = models.IntegerField()
+	text = models.TextField()
+
+	def __unicode__(self):
+		return "p. %d" % self.page
+
+class Review(models.Model):
+	class Meta:
+		ordering = ['-rating', 'reviewer']
+	book = models.ForeignKey(Book)
+	reviewer = models.CharField(max_length=100)
+	rating = models.IntegerField()
+
+	def __unicode__(self):
+		return "%s: %d" % (self.reviewer, self.rating)
+
+class Edition(models.Model):
+	class Meta:
+		ordering = ['year']
+	book = models.ForeignKey(Book)
+	year = models.IntegerField(null=True)
+
+	def __unicode__(self):
+		return "%s" % self.year
@@ -1,7 +1,23 @@
+import gc
+
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
 
-from chained.tests.server.models import Author, Book, Chapter
-from chained.tests.server.chains import LibraryChain, LibraryFormChain
+from chained import FormChain
+from chained.chain import _selected_links
+from chained.tests.server.models import (Author, Book, Chapter, Excerpt,
+		Review, Edition)
+from chained.tests.server.forms import AuthorForm, BookForm
+from chained.tests.server.chains import (LibraryChain, LibraryFormChain,
+		KeyedLibraryChain, ExcerptChain, ReviewChain, EditionChain)
+
+# the author form as rendered for "Who Pie"
+_EXPECTED_AUTHOR_FORM_HTML = ('<tr><th><label for="id_first_name">First name'
+		':</label></th><td><input id="id_first_name" type="text" '
+		'name="first_name" value="Who" maxlength="35" /></td></tr'
+		'>\n<tr><th><label for="id_last_name">Last name:</label></t'
+		'h><td><input id="id_last_name" type="text" name="last_na'
+		'me" value="Pie" maxlength="35" /></td></tr>')
 
 class ChainTests(TestCase):
 	"""
@@ -14,12 +30,20 @@ class ChainTests(TestCase):
 		self.libraryChain = LibraryChain()
 	
 	def testSelect(self):
-		# make sure selecting an object provides the right data
-		self.libraryChain.author.get_select(last_name="Wallis")
-		self.assertEquals(self.libraryChain.book.title,"Try Hard")
+		# make sure selecting an object provides the right data - the
+		# author, its first book and that book's first chapter are one
+		# query each
+		for last_name, title in (("Wallis", "Try Hard"), 
+				("Cross", "The Second to Last Samurai")):
+			with self.assertNumQueries(3):
+				self.libraryChain.author.get_select(last_name=last_name)
+			self.assertEquals(self.libraryChain.book.title, title)
 
-		self.libraryChain.author.get_select(last_name="Cross")
-		self.assertEquals(self.libraryChain.book.title,"The Second to Last Samurai")
+	def testSelectM2MChild(self):
+		# selecting a book should select its first author
+		self.libraryChain.author.get_select(last_name="Wallis")
+		self.libraryChain.book.get_select(title="Ghast")
+		self.assertEquals(self.libraryChain.author.last_name, "Less")
 	
 	def testCreateTopLevel(self):
 		# make a new author
@@ -30,17 +54,16 @@ class ChainTests(TestCase):
 		self.assertTrue(Author.objects.filter(last_name="Kidman").exists())
 
 	def testCreateM2M(self):
-		# make the new book
+		# make the new book - saving inserts it, adds the selected author
+		# and saves it again with the author connected
 		self.libraryChain.author.get_select(last_name="Cross")
-		self.libraryChain.book = Book(title="The Third to Last Samurai")
-		self.libraryChain.book.save()
-
-		# check that it was saved
-		self.assertTrue(Book.objects.filter(title="The Third to Last Samurai").exists())
+		with self.assertNumQueries(5):
+			self.libraryChain.book = Book(title="The Third to Last Samurai")
+			self.libraryChain.book.save()
 
-		# ensure that it has the correct author added
-		book = Book.objects.get(title="The Third to Last Samurai")
-		self.assertTrue(book.authors.filter(last_name="Cross").exists())
+		# ensure that it was saved with the correct author added
+		self.assertTrue(Book.objects.filter(title="The Third to Last Samurai",
+				authors__last_name="Cross").exists())
 	
 	def testConnectM2MParent(self):
 		# connect a new author to a book
@@ -48,25 +71,99 @@ class ChainTests(TestCase):
 		self.libraryChain.author.book_set.add(Book.objects.get(title="Ghast"))
 		self.libraryChain.author.save()
 
-		book = Book.objects.get(title="Ghast")
-		self.assertTrue(book.authors.filter(last_name="Stabley").exists())
+		self.assertTrue(Book.objects.filter(title="Ghast",
+				authors__last_name="Stabley").exists())
 	
+	def testSetRelatedManager(self):
+		# members that aren't fields are written through as well
+		self.libraryChain.author.get_select(last_name="Stabley")
+		self.libraryChain.author.book_set = [Book.objects.get(title="Ghast")]
+
+		self.assertTrue(Book.objects.filter(title="Ghast",
+				authors__last_name="Stabley").exists())
+
 	def testSiblingAccess(self):
 		self.libraryChain.book.get_select(title="Ghast")
 		self.assertEquals(self.libraryChain.chapter.title, "A New Apartment")
 
-		self.libraryChain.chapter.select_next_sibling()
+		# each move fetches just the chapter it moves to
+		with self.assertNumQueries(1):
+			self.libraryChain.chapter.select_next_sibling()
 		self.assertEquals(self.libraryChain.chapter.title, "Willy's Gun")
 
-		self.libraryChain.chapter.select_last()
+		with self.assertNumQueries(1):
+			self.libraryChain.chapter.select_last()
 		self.assertEquals(self.libraryChain.chapter.title, "Way Too Much Pottery")
 
-		self.libraryChain.chapter.select_previous_sibling()
+		with self.assertNumQueries(1):
+			self.libraryChain.chapter.select_previous_sibling()
 		self.assertEquals(self.libraryChain.chapter.title, "The Psychic")
 
-		self.libraryChain.chapter.select_first()
+		with self.assertNumQueries(1):
+			self.libraryChain.chapter.select_first()
 		self.assertEquals(self.libraryChain.chapter.title, "A New Apartment")
 
+	def testTiedSiblingAccess(self):
+		# chapters with the same number are ordered by pk
+		self.libraryChain.book.get_select(title="Ghast")
+		Chapter.objects.create(book=self.libraryChain.book.instance,
+				number=4, title="Tied Four")
+
+		self.libraryChain.chapter.select_last()
+		self.assertEquals(self.libraryChain.chapter.title, "Tied Four")
+		self.assertEquals(self.libraryChain.chapter.index(), 4)
+		self.assertEquals(self.libraryChain.chapter.next_sibling(), None)
+
+		self.libraryChain.chapter.select_previous_sibling()
+		self.assertEquals(self.libraryChain.chapter.title, "Way Too Much Pottery")
+		self.assertEquals(self.libraryChain.chapter.index(), 3)
+
+	def testPkOrderedSiblingAccess(self):
+		# authors have no default ordering, so they're ordered by pk
+		self.libraryChain.author.select_last()
+		self.assertEquals(self.libraryChain.author.last_name, "Stabley")
+		self.assertEquals(self.libraryChain.author.index(), 4)
+
+		self.libraryChain.author.select_previous_sibling()
+		self.assertEquals(self.libraryChain.author.last_name, "Pie")
+
+	def testM2MChangeIndex(self):
+		# adding a book to an author changes the author's link set
+		self.libraryChain.author.get_select(last_name="Wallis")
+		self.assertEquals(self.libraryChain.book.index(), 0)
+
+		ghast = Book.objects.get(title="Ghast")
+		ghast.authors.add(self.libraryChain.author.instance)
+		self.libraryChain.book.select(ghast)
+		self.assertEquals(self.libraryChain.book.index(), 1)
+
+	def testMoveChild(self):
+		# moving a chapter to another book selects that book
+		self.libraryChain.book.get_select(title="Ghast")
+		self.libraryChain.chapter.book_id = Book.objects.get(title="Try Hard").pk
+		self.libraryChain.chapter.save()
+		self.assertEquals(self.libraryChain.book.title, "Try Hard")
+
+	def testUnsignalledChange(self):
+		# rows changed without signals are found after a refetch
+		self.libraryChain.book.get_select(title="Ghast")
+		self.assertEquals(self.libraryChain.chapter.index(), 0)
+
+		Chapter.objects.filter(title="Toe Fists").update(
+				book=self.libraryChain.book.instance)
+		self.libraryChain.chapter.get_select(title="Toe Fists")
+		self.assertEquals(self.libraryChain.book.title, "Ghast")
+		self.assertEquals(self.libraryChain.chapter.index(), 0)
+		self.assertEquals(self.libraryChain.chapter.next_sibling().title,
+				"A New Apartment")
+
+	def testLinkSetParents(self):
+		# chapters are fetched together with their book
+		self.libraryChain.author.get_select(last_name="Wallis")
+		with self.assertNumQueries(1):
+			books = [chapter.book.title for chapter in self.libraryChain.chapter.link_set()]
+		self.assertEquals(books, ["Try Hard"] * 3)
+
 	def testDelete(self):
 		self.libraryChain.author.get_select(last_name="Wallis")
 
@@ -76,8 +173,112 @@ class ChainTests(TestCase):
 		self.libraryChain.author.delete()
 		self.assertEquals(self.libraryChain.author.instance, Author.objects.get(last_name="Cross"))
 	
+	def testDeleteThenNavigate(self):
+		# excerpts are ordered across their chapter, so sibling lookups
+		# use the cached pks, which must not keep the deleted row
+		chapter = Chapter.objects.get(title="Toe Fists")
+		for page in (3, 5, 9):
+			Excerpt.objects.create(chapter=chapter, page=page, text="")
+		excerptChain = ExcerptChain()
+
+		excerptChain.excerpt.select_next_sibling()
+		excerptChain.excerpt.delete()
+		self.assertEquals(excerptChain.excerpt.page, 3)
+
+		excerptChain.excerpt.select_last()
+		self.assertEquals(excerptChain.excerpt.page, 9)
+		self.assertEquals(excerptChain.excerpt.index(), 1)
+
+		excerptChain.excerpt.select_previous_sibling()
+		self.assertEquals(excerptChain.excerpt.page, 3)
+
+	def testDescendingSiblingAccess(self):
+		# reviews are ordered by descending rating and then reviewer,
+		# which is filtered on directly - one query per move
+		book = Book.objects.get(title="Try Hard")
+		for reviewer, rating in (("Bo", 3), ("Al", 5), ("Cy", 3), ("Di", 1)):
+			Review.objects.create(book=book, reviewer=reviewer, rating=rating)
+		reviewChain = ReviewChain()
+		reviewChain.book.get_select(title="Try Hard")
+		self.assertEquals(reviewChain.review.reviewer, "Al")
+
+		for reviewer in ("Bo", "Cy", "Di"):
+			with self.assertNumQueries(1):
+				reviewChain.review.select_next_sibling()
+			self.assertEquals(reviewChain.review.reviewer, reviewer)
+		self.assertEquals(reviewChain.review.next_sibling(), None)
+
+		for reviewer in ("Cy", "Bo", "Al"):
+			with self.assertNumQueries(1):
+				reviewChain.review.select_previous_sibling()
+			self.assertEquals(reviewChain.review.reviewer, reviewer)
+		self.assertEquals(reviewChain.review.previous_sibling(), None)
+
+	def testNullableSiblingAccess(self):
+		# NULL years sort first in sqlite but never match a comparison,
+		# so editions fall back to the cached sibling pks
+		book = Book.objects.get(title="Try Hard")
+		for year in (2001, None, 1999):
+			Edition.objects.create(book=book, year=year)
+		editionChain = EditionChain()
+		editionChain.book.get_select(title="Try Hard")
+		self.assertEquals(editionChain.edition.year, None)
+
+		editionChain.edition.select_next_sibling()
+		self.assertEquals(editionChain.edition.year, 1999)
+		editionChain.edition.select_next_sibling()
+		self.assertEquals(editionChain.edition.year, 2001)
+		editionChain.edition.select_previous_sibling()
+		editionChain.edition.select_previous_sibling()
+		self.assertEquals(editionChain.edition.year, None)
+
+	def testIndependentChains(self):
+		# links belong to their chain, not to the chain class
+		otherChain = LibraryChain()
+		otherChain.author.get_select(last_name="Cross")
+		self.libraryChain.author.get_select(last_name="Wallis")
+
+		self.assertNotEqual(otherChain.author, self.libraryChain.author)
+		self.assertEquals(otherChain.book.title, "The Second to Last Samurai")
+		self.assertEquals(self.libraryChain.book.title, "Try Hard")
+
+	def testAutoCreateDefaults(self):
+		libraryChain = LibraryChain(auto_create_defaults=True)
+
+		# an author without books gets a new, unsaved book
+		libraryChain.author.get_select(last_name="Stabley")
+		self.assertTrue(isinstance(libraryChain.book.instance, Book))
+		self.assertEquals(libraryChain.book.pk, None)
+
+		# a new chapter belongs to the selected book and can be saved
+		libraryChain.author.get_select(last_name="Cross")
+		libraryChain.chapter.number = 1
+		libraryChain.chapter.title = "Rivers of Blood"
+		libraryChain.chapter.save()
+
+		chapter = Chapter.objects.get(title="Rivers of Blood")
+		self.assertEquals(chapter.book.title, "The Second to Last Samurai")
+
+	def testSelectionRegistryCleanup(self):
+		# selections of garbage collected chains don't stay registered
+		for author in Author.objects.all():
+			LibraryChain().author.select(author)
+		gc.collect()
+		self.libraryChain.author.select_last()
+
+		for refs in _selected_links.values():
+			self.assertTrue(refs)
+			for link_ref in refs.values():
+				self.assertNotEqual(link_ref(), None)
+
+	def testModelKeys(self):
+		# models can be given with their own key
+		keyedChain = KeyedLibraryChain()
+		keyedChain.writer.get_select(last_name="Wallis")
+		self.assertEquals(keyedChain.book.title, "Try Hard")
+
 	def testIterate(self):
-		for link, other_ref in zip(self.libraryChain, self.libraryChain._links_list):
+		for link, other_ref in zip(self.libraryChain, self.libraryChain._links):
 			self.assertEquals(link, other_ref)
 
 
@@ -94,13 +295,43 @@ class FormChainTests(TestCase):
 	def testFormAccess(self):
 		self.libraryFormChain.author.get_select(last_name="Pie")
 		self.assertNotEqual(self.libraryFormChain.author.form, None)
-
-		expected_output = ('<tr><th><label for="id_first_name">First name'+
-				':</label></th><td><input id="id_first_name" type="text" '+
-				'name="first_name" value="Who" maxlength="35" /></td></tr'+
-				'>\n<tr><th><label for="id_last_name">Last name:</label></t'+
-				'h><td><input id="id_last_name" type="text" name="last_na'+
-				'me" value="Pie" maxlength="35" /></td></tr>')
 		self.assertEquals(str(self.libraryFormChain.author.form),
-				expected_output)
-		
\ No newline at end of file
+				_EXPECTED_AUTHOR_FORM_HTML)
+
+	def testFormReuse(self):
+		# the form is kept until another instance is selected
+		self.libraryFormChain.author.get_select(last_name="Pie")
+		form = self.libraryFormChain.author.form
+		self.assertTrue(self.libraryFormChain.author.form is form)
+
+		self.libraryFormChain.author.get_select(last_name="Cross")
+		self.assertEquals(self.libraryFormChain.author.form.instance.last_name, "Cross")
+
+	def testFormAfterSave(self):
+		# saving the selected instance rebuilds the form from its new values
+		self.libraryFormChain.author.get_select(last_name="Pie")
+		self.libraryFormChain.author.form
+		self.libraryFormChain.author.first_name = "What"
+		self.libraryFormChain.author.instance.save()
+		self.assertEquals(
+				self.libraryFormChain.author.form.initial['first_name'], "What")
+
+	def testCascadedFormAccess(self):
+		# links selected by a cascade show their new instance
+		self.libraryFormChain.author.get_select(last_name="Wallis")
+		self.assertEquals(self.libraryFormChain.book.form.instance.title, "Try Hard")
+
+		self.libraryFormChain.author.get_select(last_name="Cross")
+		self.assertEquals(self.libraryFormChain.book.form.instance.title,
+				"The Second to Last Samurai")
+
+	def testMissingFormClasses(self):
+		# every model needs a form class
+		def makeChain(**options):
+			Meta = type('Meta', (object,), options)
+			return type('BrokenFormChain', (FormChain,), dict(Meta=Meta))
+
+		self.assertRaises(ImproperlyConfigured, makeChain,
+				models=[Author, Book], forms=[AuthorForm, BookForm])
+		self.assertRaises(ImproperlyConfigured, makeChain,
+				models=[Author, Book], form_classes=[AuthorForm])